@@ -1,24 +1,135 @@
-from flask import Flask, request, jsonify, abort
+# Patch blocking I/O before anything else is imported so calls to Tika
+# yield to other requests when running under gevent workers
+from gevent import monkey
+monkey.patch_all()
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from flask import Flask, Response, request, abort
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 import time
 import os
-import threading
+import hmac
 import logging
+import socket
+import tempfile
+import gzip
+import re
+from functools import wraps
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """Encode JSON with orjson, which is much faster than the stdlib json module on large payloads"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding to str first
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Gzip responses for clients that accept it; extracted text compresses 5-10x
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/plain', 'text/html']
+app.config['COMPRESS_ALGORITHM'] = 'gzip'
+app.config['COMPRESS_LEVEL'] = 4  # Favour speed over ratio
+app.config['COMPRESS_MIN_SIZE'] = 1024  # Not worth it for tiny responses
+app.config['COMPRESS_STREAMS'] = False  # Compressing a streamed response would buffer all of it first
+Compress(app)
 
 # Configuration
 API_SECRET = os.environ.get('TIKA_SECRET', 'please-change-this-secret')
+API_SECRET_BYTES = API_SECRET.encode('utf-8')
 PORT = int(os.environ.get('PORT', 8080))
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 100 * 1024 * 1024))  # 100MB
 TIKA_PORT = 9998
+TIKA_URL = f'http://localhost:{TIKA_PORT}'
+TIKA_TIKA_URL = f'{TIKA_URL}/tika'
+TIKA_META_URL = f'{TIKA_URL}/meta'
+TIKA_DETECT_URL = f'{TIKA_URL}/detect/stream'
+TIKA_LANG_URL = f'{TIKA_URL}/language/stream'
+TIKA_VERSION_URL = f'{TIKA_URL}/version'
+TIKA_MIME_URL = f'{TIKA_URL}/mime-types'
+TIKA_PARSERS_URL = f'{TIKA_URL}/parsers'
+TIKA_STARTUP_TIMEOUT = float(os.environ.get('TIKA_STARTUP_TIMEOUT', 120))  # Seconds to wait for Tika before giving up
+# Keep-alive connections to Tika per worker. Defaults to the worker's connection
+# limit so every in-flight request can hold one; connections are opened lazily,
+# and a smaller pool makes urllib3 open and discard extras under load
+TIKA_POOL_SIZE = int(os.environ.get('TIKA_POOL_SIZE', os.environ.get('WORKER_CONNECTIONS', 1000)))
+TIKA_READY_FILE = os.environ.get('TIKA_READY_FILE', '/tmp/tika_ready')  # Created once any worker has seen Tika ready
+
+# Matches the start of every line that has non-whitespace content
+NON_EMPTY_LINE_RE = re.compile(r'^[^\S\n]*\S', re.MULTILINE)
+
+# Output format -> (Tika endpoint, Accept header) for /parse
+FORMAT_MAP = {
+    'text': (TIKA_TIKA_URL, 'text/plain'),
+    'html': (TIKA_TIKA_URL, 'text/html'),
+    'metadata': (TIKA_META_URL, 'application/json')
+}
+
+STREAM_CHUNK_SIZE = 64 * 1024  # Bytes per chunk when streaming to or from Tika
+ANALYZE_SPOOL_BYTES = 8 * 1024 * 1024  # /analyze keeps uploads up to this size in memory
+LANGUAGE_SAMPLE_BYTES = 4096  # Language detection converges on a small sample
+LANGUAGE_MAX_SAMPLE_BYTES = 1024 * 1024  # Upper bound for ?sample_bytes
+LANGUAGE_MIN_BYTES = 32  # Below this Tika's language guess is unreliable
+HEALTH_CACHE_TTL = 1.0  # Seconds a rendered /health body is served before it is rebuilt
+
+# Whole megabytes read better, but any other limit is reported exactly rather than rounded
+if MAX_UPLOAD_BYTES % (1024*1024) == 0:
+    UPLOAD_TOO_LARGE_MESSAGE = f'File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024*1024)}MB'
+else:
+    UPLOAD_TOO_LARGE_MESSAGE = f'File too large. Maximum size is {MAX_UPLOAD_BYTES} bytes'
+
+# Werkzeug rejects uploads over the limit as they are read, including
+# chunked uploads that don't declare a Content-Length
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+class TikaAdapter(HTTPAdapter):
+    """HTTPAdapter whose sockets have Nagle disabled and TCP keep-alive enabled"""
+    
+    # urllib3's defaults already include TCP_NODELAY; add SO_KEEPALIVE so idle
+    # pooled connections to Tika are kept open rather than silently dropped
+    SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+# Shared HTTP session so connections to the local Tika server are kept alive
+# and reused instead of opening a new TCP connection for every call
+TIKA_SESSION = requests.Session()
+TIKA_SESSION.headers.update({'Connection': 'keep-alive'})
+TIKA_SESSION.mount('http://', TikaAdapter(pool_connections=32, pool_maxsize=TIKA_POOL_SIZE, max_retries=0))
 
 # Global state
 tika_ready = False
 start_time = time.time()
+_TIKA_META = {}  # Tika version, parsers, MIME types and the encoded /types bodies; these only change across Tika restarts
+
+def tika_port_open():
+    """Cheap TCP probe to see whether Tika is accepting connections yet"""
+    try:
+        with socket.create_connection(('localhost', TIKA_PORT), timeout=0.2):
+            return True
+    except OSError:
+        return False
 
 def check_tika_server():
     """Check if Tika server is running and ready"""
@@ -28,96 +139,318 @@ def check_tika_server():
         logger.info("Checking Tika server status...")
         
         # The official Docker image should have Tika already running
-        # We just need to wait for it to be ready
-        max_retries = 60  # Longer timeout for full Tika server
-        for i in range(max_retries):
-            try:
-                response = requests.get(f'http://localhost:{TIKA_PORT}/version', timeout=3)
-                if response.status_code == 200:
-                    version = response.text.strip()
-                    logger.info(f"✅ Tika server ready! Version: {version}")
-                    tika_ready = True
-                    
-                    # Also check available parsers
-                    try:
-                        parsers_response = requests.get(f'http://localhost:{TIKA_PORT}/parsers', timeout=5)
-                        if parsers_response.status_code == 200:
+        # We just need to wait for it to be ready: probe the port with plain
+        # TCP connects, backing off exponentially, and only send an HTTP
+        # request once it accepts connections
+        started = time.monotonic()
+        deadline = started + TIKA_STARTUP_TIMEOUT
+        delay = 0.05
+        attempts = 0
+        while time.monotonic() < deadline:
+            # Another worker already got through to Tika; a stat is all we need
+            if os.path.exists(TIKA_READY_FILE):
+                logger.info("✅ Tika server ready (reported by another worker)")
+                tika_ready = True
+                return
+            
+            if tika_port_open():
+                try:
+                    response = TIKA_SESSION.get(TIKA_VERSION_URL, timeout=3)
+                    if response.status_code == 200:
+                        version = response.text.strip()
+                        logger.info("✅ Tika server ready! Version: %s", version)
+                        tika_ready = True
+                        mark_tika_ready()
+                        
+                        # Cache the static Tika details, which also checks available parsers.
+                        # Keep this short; anything missed is fetched on first use.
+                        _TIKA_META['version'] = version
+                        _load_tika_meta(timeout=0.5)
+                        if 'parsers' in _TIKA_META:
                             logger.info("✅ Tika parsers loaded successfully")
-                    except:
-                        logger.warning("Could not verify parsers, but server is running")
-                    
-                    return
-                    
-            except requests.exceptions.RequestException:
-                pass
+                        else:
+                            logger.warning("Could not verify parsers, but server is running")
+                        
+                        return
+                        
+                except requests.exceptions.RequestException:
+                    pass
             
-            if i % 10 == 0:  # Log every 10 attempts
-                logger.info(f"⏳ Waiting for Tika server... ({i+1}/{max_retries})")
-            time.sleep(1)
+            if attempts % 10 == 0:  # Log every 10 attempts
+                logger.info("⏳ Waiting for Tika server... (%.1fs elapsed)", time.monotonic() - started)
+            attempts += 1
+            time.sleep(delay)
+            delay = min(delay * 1.5, 1.0)
         
         logger.error("❌ Tika server failed to become ready within timeout period")
         
     except Exception as e:
-        logger.error(f"❌ Error checking Tika server: {str(e)}")
+        logger.error("❌ Error checking Tika server: %s", e)
+
+def mark_tika_ready():
+    """Create the readiness file so the other workers can skip probing Tika"""
+    try:
+        open(TIKA_READY_FILE, 'w').close()
+    except OSError as e:
+        logger.warning("Could not write readiness file %s: %s", TIKA_READY_FILE, e)
+
+def clear_tika_ready():
+    """Remove a readiness file left over from a previous run"""
+    try:
+        os.remove(TIKA_READY_FILE)
+    except FileNotFoundError:
+        pass
+
+# _TIKA_META key -> (Tika URL, function turning the response text into the cached value)
+_TIKA_META_SOURCES = {
+    'version': (TIKA_VERSION_URL, str.strip),
+    'parsers': (TIKA_PARSERS_URL, str),
+    'mime_types': (TIKA_MIME_URL, lambda text: tuple(text.strip().split('\n')))
+}
+
+def _load_tika_meta(timeout=10):
+    """Fetch whichever static Tika details aren't cached yet"""
+    for key, (url, parse) in _TIKA_META_SOURCES.items():
+        if key in _TIKA_META:
+            continue
+        try:
+            response = TIKA_SESSION.get(url, timeout=timeout)
+            if response.status_code == 200:
+                _TIKA_META[key] = parse(response.text)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not fetch Tika %s: %s", key, e)
+
+def get_tika_meta(key):
+    """Return a cached Tika detail, fetching it first if the startup prefetch missed it"""
+    if key not in _TIKA_META:
+        _load_tika_meta()
+    return _TIKA_META.get(key)
+
+def start_readiness_check():
+    """Check Tika server status in a background greenlet"""
+    return gevent.spawn(check_tika_server)
 
 def validate_api_key():
     """Validate the API key from request headers"""
     provided_key = request.headers.get('X-API-Key')
     
     if not provided_key:
-        abort(401, {'error': 'Missing X-API-Key header'})
+        abort(401, 'Missing X-API-Key header')
     
-    if provided_key != API_SECRET:
-        abort(401, {'error': 'Invalid API key'})
+    # Constant-time comparison so response timing doesn't leak the key
+    if not hmac.compare_digest(provided_key.encode('utf-8'), API_SECRET_BYTES):
+        abort(401, 'Invalid API key')
+
+def has_request_body():
+    """Check whether the request carries a body without reading it"""
+    if request.content_length:
+        return True
+    return 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+
+def require_tika(need_body=True):
+    """Decorator for endpoints that need a valid API key, a ready Tika server and (optionally) a request body"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            validate_api_key()
+            
+            if not tika_ready:
+                abort(503, 'Tika server is still starting. Please wait and try again.')
+            
+            if need_body and not has_request_body():
+                abort(400, 'No file data provided. Send file as request body.')
+            
+            # Reject declared oversize uploads before opening a connection to Tika
+            if need_body and (request.content_length or 0) > MAX_UPLOAD_BYTES:
+                abort(413, UPLOAD_TOO_LARGE_MESSAGE)
+            
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def read_text_sample(response, sample_bytes):
+    """Read up to sample_bytes of text from a streamed Tika response, skipping leading blank space"""
+    parts = []
+    size = 0
+    for chunk in response.iter_content(sample_bytes):
+        if not parts:
+            chunk = chunk.lstrip()
+        if chunk:
+            parts.append(chunk)
+            size += len(chunk)
+        if size >= sample_bytes:
+            break
+    return _trim_partial_utf8(b''.join(parts)[:sample_bytes])
+
+def _trim_partial_utf8(data):
+    """Drop a UTF-8 character that was cut off at the end of data"""
+    # Find the lead byte of the last character and check it has all its continuation bytes
+    for i in range(len(data) - 1, max(len(data) - 4, 0) - 1, -1):
+        byte = data[i]
+        if byte & 0xC0 != 0x80:
+            width = 1 if byte < 0x80 else 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return data[:i] if i + width > len(data) else data
+    return data
+
+def iter_request_body():
+    """Yield the upload in chunks so it streams to Tika without being buffered"""
+    stream = request.stream
+    while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def buffer_request_body():
+    """Read the upload once so it can be sent to Tika several times.
+    
+    Returns (body, size). Small uploads come back as bytes; anything over
+    ANALYZE_SPOOL_BYTES is spooled to a temporary file instead of memory.
+    """
+    chunks = []
+    size = 0
+    body = iter_request_body()
+    for chunk in body:
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > ANALYZE_SPOOL_BYTES:
+            spool = tempfile.TemporaryFile()
+            spool.writelines(chunks)
+            for chunk in body:
+                spool.write(chunk)
+                size += len(chunk)
+            spool.flush()
+            return spool, size
+    return b''.join(chunks), size
+
+def iter_spooled_body(spool):
+    """Yield a spooled upload using positional reads, so concurrent readers don't share a file offset"""
+    fd = spool.fileno()
+    offset = 0
+    while True:
+        chunk = os.pread(fd, STREAM_CHUNK_SIZE, offset)
+        if not chunk:
+            break
+        offset += len(chunk)
+        yield chunk
+
+def tika_text(response):
+    """Decode a Tika response body"""
+    # Tika always answers in UTF-8; setting it skips requests' charset detection
+    response.encoding = 'utf-8'
+    return response.text
+
+def tika_json_fragment(response):
+    """Return a Tika JSON body as an orjson.Fragment, or None if it isn't valid JSON.
+    
+    The fragment embeds Tika's bytes verbatim rather than parsing them only to
+    re-encode them, but orjson never checks a fragment, so the body is validated
+    first; a truncated one would otherwise corrupt the whole response.
+    """
+    if not response.headers.get('Content-Type', '').startswith('application/json'):
+        return None
+    content = response.content
+    try:
+        orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return None
+    return orjson.Fragment(content)
+
+def iter_tika_response(response):
+    """Yield a streamed Tika response in chunks and release its connection when done"""
+    try:
+        yield from response.iter_content(STREAM_CHUNK_SIZE)
+    finally:
+        response.close()
+
+# Everything on the info page except tika_ready, which is filled in per request
+_INDEX_TEMPLATE = {
+    'service': 'Secure Tika Server (Full Version)',
+    'status': 'running',
+    'version': 'Official Apache Docker Image',
+    'features': [
+        'Full Tika server with all parsers',
+        'PDF, Word, Excel, PowerPoint parsing',
+        'OCR for images and scanned documents',
+        '1400+ supported file formats',
+        'Scientific document formats',
+        'Audio/video metadata extraction',
+        'Advanced text extraction',
+        'Metadata extraction',
+        'Language detection',
+        'MIME type detection'
+    ],
+    'endpoints': {
+        'parse': 'POST /parse - Extract text from documents',
+        'metadata': 'POST /parse?format=metadata - Extract metadata only',
+        'html': 'POST /parse?format=html - Extract HTML formatted text',
+        'detect': 'POST /detect - Detect document type',
+        'language': 'POST /language - Detect document language',
+        'version': 'GET /version - Get Tika version info',
+        'parsers': 'GET /parsers - List available parsers',
+        'types': 'GET /types - List supported formats',
+        'health': 'GET /health - Health check'
+    },
+    'auth': 'Most endpoints require X-API-Key header (except /, /health, /version)'
+}
 
 @app.route('/')
 def index():
     """Basic info endpoint"""
+    return {**_INDEX_TEMPLATE, 'tika_ready': tika_ready}
+
+def health_status(ready):
+    """Build the /health payload for the given readiness"""
+    now = time.time()
+    uptime = now - start_time
     return {
-        'service': 'Secure Tika Server (Full Version)',
-        'status': 'running',
-        'tika_ready': tika_ready,
-        'version': 'Official Apache Docker Image',
-        'features': [
-            'Full Tika server with all parsers',
-            'PDF, Word, Excel, PowerPoint parsing',
-            'OCR for images and scanned documents',
-            '1400+ supported file formats',
-            'Scientific document formats',
-            'Audio/video metadata extraction',
-            'Advanced text extraction',
-            'Metadata extraction',
-            'Language detection',
-            'MIME type detection'
-        ],
-        'endpoints': {
-            'parse': 'POST /parse - Extract text from documents',
-            'metadata': 'POST /parse?format=metadata - Extract metadata only',
-            'html': 'POST /parse?format=html - Extract HTML formatted text',
-            'detect': 'POST /detect - Detect document type',
-            'language': 'POST /language - Detect document language',
-            'version': 'GET /version - Get Tika version info',
-            'parsers': 'GET /parsers - List available parsers',
-            'types': 'GET /types - List supported formats',
-            'health': 'GET /health - Health check'
-        },
-        'auth': 'Most endpoints require X-API-Key header (except /, /health, /version)'
+        'status': 'healthy' if ready else 'starting',
+        'tika_ready': ready,
+        'timestamp': now,
+        'uptime_seconds': round(uptime, 1),
+        'uptime_human': f"{int(uptime//3600)}h {int((uptime%3600)//60)}m {int(uptime%60)}s"
     }
 
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    uptime = time.time() - start_time
-    health_status = {
-        'status': 'healthy' if tika_ready else 'starting',
-        'tika_ready': tika_ready,
-        'timestamp': time.time(),
-        'uptime_seconds': round(uptime, 1),
-        'uptime_human': f"{int(uptime//3600)}h {int((uptime%3600)//60)}m {int(uptime%60)}s"
-    }
+    ready = tika_ready
+    status_code = 200 if ready else 503
+    return health_status(ready), status_code
+
+class HealthFastPath:
+    """WSGI middleware that answers GET /health before Flask routes the request.
+    
+    Orchestrators poll /health constantly, so the encoded body is reused for
+    HEALTH_CACHE_TTL seconds, or until tika_ready changes. Other requests,
+    including other methods on /health, pass through to the Flask app.
+    """
+    
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.ready = None
+        self.expires = 0.0
+        self.body = b''
     
-    status_code = 200 if tika_ready else 503
-    return health_status, status_code
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != '/health' or environ.get('REQUEST_METHOD') != 'GET':
+            return self.wsgi_app(environ, start_response)
+        
+        ready = tika_ready
+        now = time.monotonic()
+        if ready is not self.ready or now >= self.expires:
+            self.body = orjson.dumps(health_status(ready))
+            self.ready = ready
+            self.expires = now + HEALTH_CACHE_TTL
+        
+        body = self.body
+        start_response('200 OK' if ready else '503 SERVICE UNAVAILABLE', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+app.wsgi_app = HealthFastPath(app.wsgi_app)
 
 @app.route('/version')
 def version_info():
@@ -130,25 +463,11 @@ def version_info():
     }
     
     if tika_ready:
-        try:
-            # Get Tika version
-            response = requests.get(f'http://localhost:{TIKA_PORT}/version', timeout=5)
-            if response.status_code == 200:
-                result['tika_version'] = response.text.strip()
-            
-            # Get supported types count
-            types_response = requests.get(f'http://localhost:{TIKA_PORT}/mime-types', timeout=10)
-            if types_response.status_code == 200:
-                types_count = len(types_response.text.strip().split('\n'))
-                result['supported_formats'] = types_count
-            
-            # Get parsers count
-            parsers_response = requests.get(f'http://localhost:{TIKA_PORT}/parsers', timeout=10)
-            if parsers_response.status_code == 200:
-                result['available_parsers'] = 'Available via /parsers endpoint'
-                
-        except Exception as e:
-            result['tika_version'] = f'Unable to fetch details: {str(e)}'
+        result['tika_version'] = get_tika_meta('version') or 'Unable to fetch details'
+        mime_types = get_tika_meta('mime_types')
+        if mime_types is not None:
+            result['supported_formats'] = len(mime_types)
+        result['available_parsers'] = 'Available via /parsers endpoint'
     else:
         result['tika_version'] = 'Tika server starting...'
     
@@ -158,60 +477,53 @@ def version_info():
 def available_parsers():
     """Get list of available parsers (public endpoint)"""
     if not tika_ready:
-        abort(503, {'error': 'Tika server not ready'})
-        
-    try:
-        response = requests.get(f'http://localhost:{TIKA_PORT}/parsers', timeout=10)
-        if response.status_code == 200:
-            return {
-                'success': True,
-                'parsers': response.text,
-                'note': 'This shows all available parsers in the full Tika server'
-            }
-        else:
-            abort(500, {'error': f'Failed to get parsers: HTTP {response.status_code}'})
-            
-    except Exception as e:
-        abort(500, {'error': f'Could not get parsers: {str(e)}'})
+        abort(503, 'Tika server not ready')
+    
+    parsers = get_tika_meta('parsers')
+    if parsers is None:
+        abort(500, 'Could not get parsers from Tika')
+    
+    return {
+        'success': True,
+        'parsers': parsers,
+        'note': 'This shows all available parsers in the full Tika server'
+    }
 
 @app.route('/types')
+@require_tika(need_body=False)
 def supported_types():
     """List all supported MIME types"""
-    validate_api_key()
-    
-    if not tika_ready:
-        abort(503, {'error': 'Tika server not ready'})
+    # The list only changes when Tika does, so serialize it once and reuse the bytes
+    body = _TIKA_META.get('types_body')
+    if body is None:
+        mime_types = get_tika_meta('mime_types')
+        if mime_types is None:
+            abort(500, 'Could not get types from Tika')
         
-    try:
-        response = requests.get(f'http://localhost:{TIKA_PORT}/mime-types', timeout=10)
-        if response.status_code == 200:
-            types = response.text.strip().split('\n')
-            return {
-                'success': True,
-                'supported_types': types,
-                'count': len(types)
-            }
-        else:
-            abort(500, {'error': f'Failed to get types: HTTP {response.status_code}'})
-            
-    except Exception as e:
-        abort(500, {'error': f'Could not get types: {str(e)}'})
+        body = _TIKA_META['types_body'] = orjson.dumps({
+            'success': True,
+            'supported_types': mime_types,
+            'count': len(mime_types)
+        })
+        _TIKA_META['types_body_gzip'] = gzip.compress(body, compresslevel=app.config['COMPRESS_LEVEL'])
+    
+    # Serve the pre-compressed copy too; Flask-Compress leaves responses that
+    # already have a Content-Encoding alone
+    if request.accept_encodings['gzip']:
+        response = Response(_TIKA_META['types_body_gzip'], mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+    
+    return Response(body, mimetype='application/json')
 
 @app.route('/detect', methods=['POST'])
+@require_tika()
 def detect_document_type():
     """Detect document type without parsing"""
-    validate_api_key()
-    
-    if not tika_ready:
-        abort(503, {'error': 'Tika server is still starting'})
-    
-    if not request.data:
-        abort(400, {'error': 'No file data provided'})
-    
     try:
-        response = requests.put(
-            f'http://localhost:{TIKA_PORT}/detect/stream',
-            data=request.data,
+        response = TIKA_SESSION.put(
+            TIKA_DETECT_URL,
+            data=iter_request_body(),
             headers={'Content-Type': 'application/octet-stream'},
             timeout=30
         )
@@ -220,44 +532,52 @@ def detect_document_type():
             return {
                 'success': True,
                 'mime_type': response.text.strip(),
-                'file_size': len(request.data)
+                'file_size': request.content_length
             }
         else:
-            abort(500, {'error': f'Detection failed: HTTP {response.status_code}'})
+            abort(500, f'Detection failed: HTTP {response.status_code}')
+        
+    except HTTPException:
+        raise
         
     except Exception as e:
-        abort(500, {'error': f'Detection failed: {str(e)}'})
+        abort(500, f'Detection failed: {str(e)}')
 
 @app.route('/language', methods=['POST'])
+@require_tika()
 def detect_language():
     """Detect document language"""
-    validate_api_key()
-    
-    if not tika_ready:
-        abort(503, {'error': 'Tika server is still starting'})
-    
-    if not request.data:
-        abort(400, {'error': 'No file data provided'})
+    sample_bytes = request.args.get('sample_bytes', LANGUAGE_SAMPLE_BYTES, type=int)
+    if sample_bytes <= 0:
+        abort(400, 'sample_bytes must be a positive integer')
+    sample_bytes = min(sample_bytes, LANGUAGE_MAX_SAMPLE_BYTES)
     
     try:
-        # First extract text, then detect language
-        text_response = requests.put(
-            f'http://localhost:{TIKA_PORT}/tika',
-            data=request.data,
+        # First extract text, but only read as much as language detection needs.
+        # Closing the stream early stops Tika from sending the rest of the document.
+        with TIKA_SESSION.put(
+            TIKA_TIKA_URL,
+            data=iter_request_body(),
             headers={'Accept': 'text/plain'},
-            timeout=60
-        )
-        
-        if text_response.status_code != 200:
-            abort(500, {'error': f'Text extraction failed: HTTP {text_response.status_code}'})
+            timeout=60,
+            stream=True
+        ) as text_response:
+            if text_response.status_code != 200:
+                abort(500, f'Text extraction failed: HTTP {text_response.status_code}')
+            
+            sample = read_text_sample(text_response, sample_bytes)
         
-        if not text_response.text.strip():
+        stripped_length = len(sample.strip())
+        if not stripped_length:
             return {'success': False, 'error': 'No text could be extracted for language detection'}
         
-        # Detect language from extracted text
-        lang_response = requests.put(
-            f'http://localhost:{TIKA_PORT}/language/stream',
-            data=text_response.text.encode('utf-8'),
+        if stripped_length < LANGUAGE_MIN_BYTES:
+            return {'success': False, 'error': 'Not enough text for reliable language detection'}
+        
+        # Detect language from the extracted sample
+        lang_response = TIKA_SESSION.put(
+            TIKA_LANG_URL,
+            data=sample,
             headers={'Content-Type': 'text/plain'},
             timeout=10
         )
@@ -266,185 +586,182 @@ def detect_language():
             return {
                 'success': True,
                 'language': lang_response.text.strip(),
-                'text_length': len(text_response.text),
+                'sample_length': len(sample),  # Bytes of extracted text sent for detection
                 'confidence': 'Language detection completed'
             }
         else:
-            abort(500, {'error': f'Language detection failed: HTTP {lang_response.status_code}'})
+            abort(500, f'Language detection failed: HTTP {lang_response.status_code}')
+        
+    except HTTPException:
+        raise
         
     except Exception as e:
-        abort(500, {'error': f'Language detection failed: {str(e)}'})
+        abort(500, f'Language detection failed: {str(e)}')
 
 @app.route('/parse', methods=['POST'])
+@require_tika()
 def parse_document():
     """Main document parsing endpoint"""
-    validate_api_key()
-    
-    if not tika_ready:
-        abort(503, {'error': 'Tika server is still starting. Please wait and try again.'})
-    
-    if not request.data:
-        abort(400, {'error': 'No file data provided. Send file as request body.'})
-    
-    # Check file size (limit to 100MB)
-    max_size = 100 * 1024 * 1024  # 100MB
-    if len(request.data) > max_size:
-        abort(413, {'error': f'File too large. Maximum size is {max_size // (1024*1024)}MB'})
+    file_size = request.content_length
     
     try:
         # Get optional parameters
         output_format = request.args.get('format', 'text')  # text, html, or metadata
+        # Return Tika's output as-is, on request or for clients that prefer plain text over JSON
+        raw_output = request.args.get('raw') == '1' or request.accept_mimetypes.best == 'text/plain'
         
-        # Determine Tika endpoint based on format
-        if output_format == 'html':
-            tika_endpoint = f'http://localhost:{TIKA_PORT}/tika'
-            accept_header = 'text/html'
-        elif output_format == 'metadata':
-            tika_endpoint = f'http://localhost:{TIKA_PORT}/meta'
-            accept_header = 'application/json'
-        else:  # default to plain text
-            tika_endpoint = f'http://localhost:{TIKA_PORT}/tika'
-            accept_header = 'text/plain'
+        # Determine Tika endpoint based on format (default to plain text)
+        tika_endpoint, accept_header = FORMAT_MAP.get(output_format, FORMAT_MAP['text'])
         
         # Forward request to Tika server
-        logger.info(f"Processing document: format={output_format}, size={len(request.data)} bytes")
+        logger.info("Processing document: format=%s, size=%s bytes", output_format, file_size)
         
         start_processing = time.time()
-        response = requests.put(
+        response = TIKA_SESSION.put(
             tika_endpoint,
-            data=request.data,
+            data=iter_request_body(),
             headers={
                 'Accept': accept_header,
                 'Content-Type': request.headers.get('Content-Type', 'application/octet-stream')
             },
-            timeout=300  # 5 minutes for very large documents
+            timeout=300,  # 5 minutes for very large documents
+            stream=raw_output
         )
         processing_time = time.time() - start_processing
         
         if response.status_code != 200:
-            logger.error(f"Tika server error: {response.status_code} - {response.text[:500]}")
-            abort(500, {'error': f'Tika processing failed: HTTP {response.status_code}'})
+            logger.error("Tika server error: %s - %s", response.status_code, response.text[:500])
+            abort(500, f'Tika processing failed: HTTP {response.status_code}')
+        
+        if raw_output:
+            # Pass Tika's bytes straight through without decoding or wrapping them
+            content_type = response.headers.get('Content-Type', accept_header)
+            headers = {'Vary': 'Accept', 'X-Processing-Time': f'{processing_time:.3f}'}
+            if file_size is not None:
+                headers['X-File-Size'] = str(file_size)
+            return Response(iter_tika_response(response), content_type=content_type, headers=headers)
         
         # Prepare response
         result = {
             'success': True,
             'format': output_format,
             'processing_time': round(processing_time, 3),
-            'file_size': len(request.data),
+            'file_size': file_size,
             'server_version': 'Full Tika Server'
         }
         
         if output_format == 'metadata':
-            try:
-                result['metadata'] = response.json()
-                # Add some metadata stats
-                if isinstance(result['metadata'], dict):
-                    result['metadata_fields'] = len(result['metadata'])
-            except:
-                result['metadata'] = response.text
+            metadata = tika_json_fragment(response)
+            result['metadata'] = metadata if metadata is not None else tika_text(response)
                 
         else:
-            result['content'] = response.text
-            result['content_length'] = len(response.text)
+            text = tika_text(response)
+            text_length = len(text)
+            result['content'] = text
+            result['content_length'] = text_length
             
             # Add some basic text analysis
-            if response.text:
-                lines = response.text.split('\n')
-                words = response.text.split()
+            if text:
                 result['text_stats'] = {
-                    'lines': len(lines),
-                    'words': len(words),
-                    'characters': len(response.text)
+                    'lines': text.count('\n') + 1,
+                    'words': len(text.split()),
+                    'characters': text_length
                 }
         
-        logger.info(f"✅ Document processed successfully in {processing_time:.3f}s")
-        return result
+        logger.info("✅ Document processed successfully in %.3fs", processing_time)
+        # The Accept header decides between this and the raw response, so caches must key on it
+        return result, {'Vary': 'Accept'}
+        
+    except HTTPException:
+        raise
         
     except requests.exceptions.Timeout:
         logger.error("Tika processing timeout")
-        abort(504, {'error': 'Document processing timeout. File may be too large or complex.'})
+        abort(504, 'Document processing timeout. File may be too large or complex.')
         
     except requests.exceptions.RequestException as e:
-        logger.error(f"Tika server connection error: {str(e)}")
-        abort(503, {'error': 'Tika server unavailable'})
+        logger.error("Tika server connection error: %s", e)
+        abort(503, 'Tika server unavailable')
         
     except Exception as e:
-        logger.error(f"Unexpected error during processing: {str(e)}")
-        abort(500, {'error': 'Internal server error'})
+        logger.error("Unexpected error during processing: %s", e)
+        abort(500, 'Internal server error')
 
 # Advanced endpoint for comprehensive analysis
 @app.route('/analyze', methods=['POST'])
+@require_tika()
 def analyze_document():
     """Comprehensive document analysis (text + metadata + type detection)"""
-    validate_api_key()
-    
-    if not tika_ready:
-        abort(503, {'error': 'Tika server not ready'})
+    start_time = time.time()
+    body, file_size = buffer_request_body()
     
-    if not request.data:
-        abort(400, {'error': 'No file data provided'})
+    def body_data():
+        # Each Tika call needs its own pass over the upload
+        return body if isinstance(body, bytes) else iter_spooled_body(body)
     
+    jobs = []
     try:
-        start_time = time.time()
         results = {}
         
-        # 1. Detect document type
-        logger.info("Analyzing document: detecting type...")
-        detect_response = requests.put(
-            f'http://localhost:{TIKA_PORT}/detect/stream',
-            data=request.data,
+        # 1-3. Detect type, extract metadata and extract text. These are
+        # independent, so run each in its own greenlet and wait for the slowest one
+        logger.info("Analyzing document: detecting type, extracting metadata and text...")
+        detect_job = gevent.spawn(
+            TIKA_SESSION.put,
+            TIKA_DETECT_URL,
+            data=body_data(),
             headers={'Content-Type': 'application/octet-stream'},
             timeout=30
         )
-        
-        if detect_response.status_code == 200:
-            results['mime_type'] = detect_response.text.strip()
-        
-        # 2. Extract metadata
-        logger.info("Analyzing document: extracting metadata...")
-        metadata_response = requests.put(
-            f'http://localhost:{TIKA_PORT}/meta',
-            data=request.data,
+        metadata_job = gevent.spawn(
+            TIKA_SESSION.put,
+            TIKA_META_URL,
+            data=body_data(),
             headers={'Accept': 'application/json'},
             timeout=120
         )
-        
-        if metadata_response.status_code == 200:
-            try:
-                results['metadata'] = metadata_response.json()
-            except:
-                results['metadata'] = {'error': 'Could not parse metadata JSON'}
-        
-        # 3. Extract text
-        logger.info("Analyzing document: extracting text...")
-        text_response = requests.put(
-            f'http://localhost:{TIKA_PORT}/tika',
-            data=request.data,
+        text_job = gevent.spawn(
+            TIKA_SESSION.put,
+            TIKA_TIKA_URL,
+            data=body_data(),
             headers={'Accept': 'text/plain'},
             timeout=120
         )
+        jobs = [detect_job, metadata_job, text_job]
+        
+        # 1. Document type
+        detect_response = detect_job.get()
+        if detect_response.status_code == 200:
+            results['mime_type'] = detect_response.text.strip()
         
+        # 2. Metadata
+        metadata_response = metadata_job.get()
+        if metadata_response.status_code == 200:
+            metadata = tika_json_fragment(metadata_response)
+            results['metadata'] = metadata if metadata is not None else {'error': 'Could not parse metadata JSON'}
+        
+        # 3. Text, then language detection on it
+        text_response = text_job.get()
         if text_response.status_code == 200:
-            text = text_response.text
-            results['text_preview'] = text[:1000] + ('...' if len(text) > 1000 else '')
-            results['text_length'] = len(text)
+            text = tika_text(text_response)
+            text_length = len(text)
+            results['text_preview'] = text[:1000] + ('...' if text_length > 1000 else '')
+            results['text_length'] = text_length
             
             # Basic text analysis
             if text.strip():
-                lines = text.split('\n')
-                words = text.split()
                 results['text_analysis'] = {
-                    'lines': len(lines),
-                    'words': len(words),
-                    'characters': len(text),
-                    'non_empty_lines': len([l for l in lines if l.strip()])
+                    'lines': text.count('\n') + 1,
+                    'words': len(text.split()),
+                    'characters': text_length,
+                    'non_empty_lines': sum(1 for _ in NON_EMPTY_LINE_RE.finditer(text))
                 }
                 
                 # Try language detection
                 try:
-                    lang_response = requests.put(
-                        f'http://localhost:{TIKA_PORT}/language/stream',
-                        data=text.encode('utf-8'),
+                    lang_response = TIKA_SESSION.put(
+                        TIKA_LANG_URL,
+                        data=text_response.content,  # Tika's UTF-8 bytes, no need to re-encode the text
                         headers={'Content-Type': 'text/plain'},
                         timeout=10
                     )
@@ -458,52 +775,68 @@ def analyze_document():
         results['analysis_summary'] = {
             'success': True,
             'processing_time': round(processing_time, 3),
-            'file_size': len(request.data),
+            'file_size': file_size,
             'components_analyzed': ['type_detection', 'metadata_extraction', 'text_extraction', 'language_detection']
         }
         
-        logger.info(f"✅ Document analysis completed in {processing_time:.3f}s")
+        logger.info("✅ Document analysis completed in %.3fs", processing_time)
         return results
         
+    except HTTPException:
+        raise
+        
     except Exception as e:
-        logger.error(f"Document analysis failed: {str(e)}")
-        abort(500, {'error': f'Analysis failed: {str(e)}'})
+        logger.error("Document analysis failed: %s", e)
+        abort(500, f'Analysis failed: {str(e)}')
+        
+    finally:
+        # If one call failed the others may still be reading the spool, and a
+        # closed descriptor can be reused by another request's spool file, so
+        # let them all finish before closing it
+        gevent.joinall(jobs)
+        for job in jobs:
+            if job.successful():
+                job.value.close()
+        if not isinstance(body, bytes):
+            body.close()
 
 # Error handlers
 @app.errorhandler(401)
 def unauthorized(error):
-    return jsonify({'error': 'Unauthorized', 'message': str(error.description)}), 401
+    return {'error': 'Unauthorized', 'message': error.description}, 401
 
 @app.errorhandler(400)
 def bad_request(error):
-    return jsonify({'error': 'Bad Request', 'message': str(error.description)}), 400
+    return {'error': 'Bad Request', 'message': error.description}, 400
 
-@app.errorhandler(413)
+@app.errorhandler(RequestEntityTooLarge)
 def too_large(error):
-    return jsonify({'error': 'File Too Large', 'message': str(error.description)}), 413
+    # Werkzeug raises this itself once an upload passes MAX_CONTENT_LENGTH,
+    # so always report the configured limit rather than its generic text
+    return {'error': 'File Too Large', 'message': UPLOAD_TOO_LARGE_MESSAGE}, 413
 
 @app.errorhandler(500)
 def internal_error(error):
-    return jsonify({'error': 'Internal Server Error', 'message': str(error.description)}), 500
+    return {'error': 'Internal Server Error', 'message': error.description}, 500
 
 @app.errorhandler(503)
 def service_unavailable(error):
-    return jsonify({'error': 'Service Unavailable', 'message': str(error.description)}), 503
+    return {'error': 'Service Unavailable', 'message': error.description}, 503
 
 @app.errorhandler(504)
 def gateway_timeout(error):
-    return jsonify({'error': 'Gateway Timeout', 'message': str(error.description)}), 504
+    return {'error': 'Gateway Timeout', 'message': error.description}, 504
 
 if __name__ == '__main__':
     # Record start time
     start_time = time.time()
     
-    # Check Tika server status in background thread
+    # Check Tika server status in background greenlet
     logger.info("🚀 Starting Secure Tika Server (Full Version)...")
-    tika_thread = threading.Thread(target=check_tika_server, daemon=True)
-    tika_thread.start()
+    clear_tika_ready()
+    start_readiness_check()
     
-    # Start Flask app
-    logger.info(f"🌐 Starting Flask app on port {PORT}")
+    # Start Flask app on gevent's WSGI server so slow Tika calls don't block other requests
+    logger.info("🌐 Starting Flask app on port %s", PORT)
     logger.info("📋 Using official Apache Tika Docker image with full parser support")
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    WSGIServer(('0.0.0.0', PORT), app).serve_forever()
@@ -0,0 +1,33 @@
+import multiprocessing
+import os
+
+# Server socket
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+
+# Worker processes - gevent workers let concurrent uploads overlap while
+# they wait on Tika instead of serializing behind one blocking request, so
+# one worker per core is enough and leaves CPU for Tika's JVM
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+keepalive = 75
+timeout = 180
+
+def on_starting(server):
+    """Drop a readiness file left by a previous run before any worker checks it.
+
+    Runs in the master, so it avoids importing app (and its gevent patching).
+    """
+    try:
+        os.remove(os.environ.get('TIKA_READY_FILE', '/tmp/tika_ready'))
+    except FileNotFoundError:
+        pass
+
+def post_worker_init(worker):
+    """Each worker keeps its own readiness flag, so start the Tika check here.
+    
+    The first worker to reach Tika writes the readiness file; the others
+    pick it up instead of probing Tika themselves.
+    """
+    from app import start_readiness_check
+    start_readiness_check()